@@ -5,25 +5,35 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
+import plotly.graph_objects as go
 import sqlite3
 import bcrypt
 import os
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import re
+import io
+import threading
+import queue
+from contextlib import contextmanager
+import base64
 import urllib3
 
 # Disable SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Precompiled form validation pattern
+EMAIL_RE = re.compile(r"^[^@]+@[^@]+\.[^@]+$")
+
 # Config
 st.set_page_config(page_title="QRupees Dashboard", page_icon="📊", layout="wide")
 
 # Initialize Theme
-if 'theme' not in st.session_state:
-    st.session_state.theme = "Dark"
+st.session_state.setdefault("theme", "Dark")
 
 # Inject CSS based on Theme
 if st.session_state.theme == "Light":
@@ -57,59 +67,170 @@ if st.session_state.theme == "Light":
     </style>
     """, unsafe_allow_html=True)
 
-# Inject CSS for webpage-like styling (if you have Style.css, otherwise skip or create an empty file)
-if os.path.exists("Style.css") and st.session_state.theme == "Dark":
+# Inject CSS for webpage-like styling (if you have Style.css, otherwise skip or create an empty file).
+# Read once per process; the block itself must still be emitted on every full rerun or the styling drops
+@st.cache_resource(show_spinner=False)
+def _dark_css():
+    if not os.path.exists("Style.css"):
+        return None
     with open("Style.css", "r") as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        return f"<style>{f.read()}</style>"
+
+if st.session_state.theme == "Dark" and _dark_css():
+    st.markdown(_dark_css(), unsafe_allow_html=True)
 
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import json
+import orjson
+
+USER_FIELDS = ("id", "email", "password", "is_admin")
+REG_FIELDS = ("id", "user_id", "full_name")
+
+def _padded_rows(value_range, width):
+    # The API drops trailing empty cells, so short rows are padded back out; row 1 (header) is skipped
+    return [row + [''] * (width - len(row)) for row in value_range.get('values', [])[1:]]
+
+# Cached Google Sheets reads: one values_batch_get per TTL window for both worksheets,
+# limited to the columns the app actually uses (Users A:D, Registrations A:C and AA).
+# Writes must call _load_db.clear() so the next read sees the new rows.
+@st.cache_data(ttl=60, show_spinner=False)
+def _load_db(_sheet_users, _sheet_regs):
+    users_title, regs_title = _sheet_users.title, _sheet_regs.title
+    resp = _sheet_users.spreadsheet.values_batch_get(
+        [f"'{users_title}'!A:D", f"'{regs_title}'!A:C", f"'{regs_title}'!AA:AA"],
+        params={'valueRenderOption': 'UNFORMATTED_VALUE'})
+    users_range, regs_range, approved_range = resp['valueRanges']
+
+    users = [dict(zip(USER_FIELDS, row)) for row in _padded_rows(users_range, len(USER_FIELDS))]
+    users = [r for r in users if r['id'] != '']
+    by_email = {r['email']: r for r in users}
+    by_id = {r['id']: r for r in users}
+
+    reg_rows = _padded_rows(regs_range, len(REG_FIELDS))
+    approved = [row[0] for row in _padded_rows(approved_range, 1)]
+    approved += [''] * (len(reg_rows) - len(approved))
+    regs, row_by_id = [], {}
+    for i, (row, flag) in enumerate(zip(reg_rows, approved)):
+        if row[0] == '':
+            continue
+        regs.append(dict(zip(REG_FIELDS, row), approved=flag))
+        # gspread rows are 1-indexed and row 1 is the header, so data starts at row 2
+        row_by_id[row[0]] = i + 2
+    by_user_id = {r['user_id']: r for r in regs}
+    return (users, by_email, by_id), (regs, by_user_id, row_by_id)
+
+SCOPE = ('https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive')
+
+# Service-account credentials parsed from Streamlit secrets once per process (RSA key parsing is slow)
+@st.cache_resource(show_spinner=False)
+def _creds():
+    return ServiceAccountCredentials.from_json_keyfile_dict(dict(st.secrets["gcp_service_account"]), list(SCOPE))
+
+# Authorized gspread session and worksheet handles, opened once per process
+@st.cache_resource(show_spinner=False)
+def _get_gspread_handles():
+    creds = _creds()
+    client = gspread.authorize(creds)
+    
+    # Open sheets (Must create these in Google Sheets first)
+    sheet_url = "QRupees_DB" # You can use title or key
+    try:
+        spreadsheet = client.open("QRupees_DB")
+    except:
+        # Create if not exists (requires more permissions usually, so assume it exists or fallback)
+        spreadsheet = client.create("QRupees_DB")
+        spreadsheet.share(creds.service_account_email, perm_type='user', role='writer')
+    
+    # Get or create worksheets
+    try:
+        sheet_users = spreadsheet.worksheet("Users")
+    except:
+        sheet_users = spreadsheet.add_worksheet(title="Users", rows=1000, cols=10)
+        sheet_users.append_row(["id", "email", "password", "is_admin"])
+        
+    try:
+        sheet_regs = spreadsheet.worksheet("Registrations")
+    except:
+        sheet_regs = spreadsheet.add_worksheet(title="Registrations", rows=1000, cols=30)
+        sheet_regs.append_row(["id", "user_id", "full_name", "phone", "address", "city", "state", "zip_code", 
+                               "country", "highest_degree", "field_of_study", "university", "graduation_year", 
+                               "certifications", "trading_duration", "trading_style", "markets", "specializations", 
+                               "current_occupation", "company", "years_of_experience", "linkedin", "about_yourself", 
+                               "goals", "references", "consent", "approved"])
+    
+    return sheet_users, sheet_regs
+
+# SQLite pool: one writer connection behind a lock, plus reader connections handed out per call
+class SQLitePool:
+    def __init__(self, path, max_readers=4):
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._writer = self._connect()
+        self._readers = queue.LifoQueue(maxsize=max_readers)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL lets readers run alongside the writer; NORMAL sync drops one fsync per commit
+        conn.executescript("PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA temp_store=MEMORY; "
+                           "PRAGMA mmap_size=268435456; PRAGMA cache_size=-20000; PRAGMA busy_timeout=5000;")
+        return conn
+
+    @contextmanager
+    def reader(self):
+        # Reuse an idle reader if there is one, otherwise open another
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn.cursor()
+        finally:
+            try:
+                self._readers.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def writer(self):
+        # Commits on success, rolls back on error; writers queue on the lock instead of hitting SQLITE_BUSY
+        with self._write_lock, self._writer:
+            yield self._writer.cursor()
+
+@st.cache_resource(show_spinner=False)
+def _get_sqlite():
+    return SQLitePool(DB_FILE)
+
+def _append_cells_request(sheet, row):
+    # Sheets API appendCells request for one row; values are written as-is, like RAW input
+    cells = []
+    for value in row:
+        if value is None or value == '':
+            cells.append({})
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append({'userEnteredValue': {'numberValue': value}})
+        else:
+            cells.append({'userEnteredValue': {'stringValue': str(value)}})
+    return {'appendCells': {'sheetId': sheet.id, 'rows': [{'values': cells}], 'fields': 'userEnteredValue'}}
+
+# approved is column 27 (AA) of the Registrations sheet, based on create_registration list
+REG_APPROVED_COL = 27
 
 # DB Adapter Class
 class DBAdapter:
     def __init__(self):
         self.mode = "sqlite"
-        self.conn = None
-        self.c = None
+        self.pool = None
         self.sheet_users = None
         self.sheet_regs = None
+        # Next integer id per worksheet title, counted in-process after one column read
+        self._next_ids = {}
+        self._id_lock = threading.Lock()
         
         # Try to connect to Google Sheets
         try:
             if "gcp_service_account" in st.secrets:
-                # Load credentials from Streamlit secrets
-                creds_dict = dict(st.secrets["gcp_service_account"])
-                scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-                creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-                client = gspread.authorize(creds)
-                
-                # Open sheets (Must create these in Google Sheets first)
-                sheet_url = "QRupees_DB" # You can use title or key
-                try:
-                    spreadsheet = client.open("QRupees_DB")
-                except:
-                    # Create if not exists (requires more permissions usually, so assume it exists or fallback)
-                    spreadsheet = client.create("QRupees_DB")
-                    spreadsheet.share(creds_dict['client_email'], perm_type='user', role='writer')
-                
-                # Get or create worksheets
-                try:
-                    self.sheet_users = spreadsheet.worksheet("Users")
-                except:
-                    self.sheet_users = spreadsheet.add_worksheet(title="Users", rows=1000, cols=10)
-                    self.sheet_users.append_row(["id", "email", "password", "is_admin"])
-                    
-                try:
-                    self.sheet_regs = spreadsheet.worksheet("Registrations")
-                except:
-                    self.sheet_regs = spreadsheet.add_worksheet(title="Registrations", rows=1000, cols=30)
-                    self.sheet_regs.append_row(["id", "user_id", "full_name", "phone", "address", "city", "state", "zip_code", 
-                                                "country", "highest_degree", "field_of_study", "university", "graduation_year", 
-                                                "certifications", "trading_duration", "trading_style", "markets", "specializations", 
-                                                "current_occupation", "company", "years_of_experience", "linkedin", "about_yourself", 
-                                                "goals", "references", "consent", "approved"])
-                
+                self.sheet_users, self.sheet_regs = _get_gspread_handles()
                 self.mode = "gsheets"
                 st.toast("Connected to Google Sheets Database", icon="☁️")
         except Exception as e:
@@ -118,192 +239,401 @@ class DBAdapter:
         
         # Fallback to SQLite
         if self.mode == "sqlite":
-            self.conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-            self.c = self.conn.cursor()
+            self.pool = _get_sqlite()
             self.create_sqlite_tables()
             st.toast("Using Local SQLite Database", icon="📂")
 
     def create_sqlite_tables(self):
-        self.c.execute('''CREATE TABLE IF NOT EXISTS users 
+        with self.pool.writer() as c:
+            self._create_tables(c)
+
+    def _create_tables(self, c):
+        c.execute('''CREATE TABLE IF NOT EXISTS users 
              (id INTEGER PRIMARY KEY, email TEXT UNIQUE, password BLOB, is_admin INTEGER DEFAULT 0)''')
-        self.c.execute('''CREATE TABLE IF NOT EXISTS registrations 
+        c.execute('''CREATE TABLE IF NOT EXISTS registrations 
              (id INTEGER PRIMARY KEY, user_id INTEGER, full_name TEXT, phone TEXT, address TEXT, city TEXT, 
               state TEXT, zip_code TEXT, country TEXT, highest_degree TEXT, field_of_study TEXT, university TEXT, 
               graduation_year INTEGER, certifications TEXT, trading_duration TEXT, trading_style TEXT, 
               markets TEXT, specializations TEXT, current_occupation TEXT, company TEXT, years_of_experience TEXT, 
               linkedin TEXT, about_yourself TEXT, goals TEXT, "references" TEXT, consent INTEGER, approved INTEGER DEFAULT 0)''')
-        self.conn.commit()
+        # users.email is already indexed via UNIQUE; pending lookups only ever ask for approved = 0
+        c.execute("CREATE INDEX IF NOT EXISTS idx_reg_user_id ON registrations(user_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_reg_approved ON registrations(approved) WHERE approved = 0")
     
+    def _users(self):
+        return _load_db(self.sheet_users, self.sheet_regs)[0]
+
+    def _regs(self):
+        return _load_db(self.sheet_users, self.sheet_regs)[1]
+
+    def _take_id(self, sheet):
+        with self._id_lock:
+            if sheet.title not in self._next_ids:
+                # Column A holds the header plus one id per row, so its length is the next id
+                self._next_ids[sheet.title] = len(sheet.col_values(1))
+            new_id = self._next_ids[sheet.title]
+            self._next_ids[sheet.title] += 1
+            return new_id
+
     def get_user(self, email):
         if self.mode == "gsheets":
             try:
-                records = self.sheet_users.get_all_records()
-                for i, r in enumerate(records):
-                    if r['email'] == email:
-                        # Return tuple to match SQLite format: (id, password, is_admin)
-                        # Password in sheets should be stored as string, we might need to encode back to bytes for bcrypt
-                        return (r['id'], r['password'].encode('latin-1'), r['is_admin']) 
-                return None
+                _, by_email, _ = self._users()
+                r = by_email.get(email)
+                if r is None:
+                    return None
+                # Return tuple to match SQLite format: (id, password, is_admin)
+                # Password is stored base64-encoded; rows written before that hold the raw "$2b$..." hash
+                stored = str(r['password'])
+                password_hash = stored.encode('latin-1') if stored.startswith('$2') else base64.b64decode(stored)
+                return (r['id'], password_hash, r['is_admin'])
             except:
                 return None
         else:
-            self.c.execute("SELECT id, password, is_admin FROM users WHERE email=?", (email,))
-            return self.c.fetchone()
+            with self.pool.reader() as c:
+                c.execute("SELECT id, password, is_admin FROM users WHERE email=?", (email,))
+                return c.fetchone()
 
     def create_user(self, email, password_hash, is_admin=0):
         if self.mode == "gsheets":
-            # Generate simple integer ID (max id + 1)
-            records = self.sheet_users.get_all_records()
-            new_id = len(records) + 1
-            # Store password hash as latin-1 string
-            self.sheet_users.append_row([new_id, email, password_hash.decode('latin-1'), is_admin])
+            # Generate simple integer ID (max id + 1) without re-reading the whole sheet
+            new_id = self._take_id(self.sheet_users)
+            # Store password hash as base64 so Sheets never reinterprets it
+            self.sheet_users.append_rows([[new_id, email, base64.b64encode(password_hash).decode('ascii'), is_admin]], value_input_option='RAW')
+            _load_db.clear()
             return new_id
         else:
-            self.c.execute("INSERT OR IGNORE INTO users (email, password, is_admin) VALUES (?, ?, ?)", (email, password_hash, is_admin))
-            self.conn.commit()
-            return self.c.lastrowid
+            with self.pool.writer() as c:
+                return self._insert_user(c, email, password_hash, is_admin)
+
+    def _insert_user(self, c, email, password_hash, is_admin=0):
+        c.execute("INSERT OR IGNORE INTO users (email, password, is_admin) VALUES (?, ?, ?)", (email, password_hash, is_admin))
+        return c.lastrowid
             
     def get_registration(self, user_id):
         if self.mode == "gsheets":
-            records = self.sheet_regs.get_all_records()
-            for r in records:
-                if r['user_id'] == user_id:
-                    # Return approved status. SQLite returns tuple, let's return object that behaves similarly or just the field
-                    # The calling code expects: reg[0] == 1 (approved)
-                    return (r['approved'],) 
-            return None
+            _, by_user_id, _ = self._regs()
+            r = by_user_id.get(user_id)
+            if r is None:
+                return None
+            # Return approved status. SQLite returns tuple, let's return object that behaves similarly or just the field
+            # The calling code expects: reg[0] == 1 (approved)
+            return (r['approved'],)
         else:
-            self.c.execute("SELECT approved FROM registrations WHERE user_id=?", (user_id,))
-            return self.c.fetchone()
+            with self.pool.reader() as c:
+                c.execute("SELECT approved FROM registrations WHERE user_id=?", (user_id,))
+                return c.fetchone()
             
     def create_registration(self, data):
         if self.mode == "gsheets":
-            # Add an ID column at start
-            records = self.sheet_regs.get_all_records()
-            new_id = len(records) + 1
-            row = [new_id] + list(data)
-            self.sheet_regs.append_row(row)
+            # Add an ID column at start and the approved flag (0) at the end
+            new_id = self._take_id(self.sheet_regs)
+            row = [new_id] + list(data) + [0]
+            self.sheet_regs.append_rows([row], value_input_option='RAW')
+            _load_db.clear()
+        else:
+            with self.pool.writer() as c:
+                self._insert_registration(c, data)
+
+    def _insert_registration(self, c, data):
+        c.execute("""INSERT INTO registrations (user_id, full_name, phone, address, city, state, zip_code, country, 
+                     highest_degree, field_of_study, university, graduation_year, certifications, trading_duration, 
+                     trading_style, markets, specializations, current_occupation, company, years_of_experience, 
+                     linkedin, about_yourself, goals, "references", consent, approved) 
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)""", data)
+
+    def register_trader(self, email, password_hash, reg_fields):
+        # Writes the user row and the registration row together: one Sheets request or one SQLite commit
+        if self.mode == "gsheets":
+            user_id = self._take_id(self.sheet_users)
+            reg_id = self._take_id(self.sheet_regs)
+            user_row = [user_id, email, base64.b64encode(password_hash).decode('ascii'), 0]
+            reg_row = [reg_id, user_id] + list(reg_fields) + [0]
+            # Both appends go in one batch request; appendCells always lands after the last filled row
+            self.sheet_users.spreadsheet.batch_update({'requests': [
+                _append_cells_request(self.sheet_users, user_row),
+                _append_cells_request(self.sheet_regs, reg_row),
+            ]})
+            _load_db.clear()
+            return user_id
         else:
-            self.c.execute("""INSERT INTO registrations (user_id, full_name, phone, address, city, state, zip_code, country, 
-                              highest_degree, field_of_study, university, graduation_year, certifications, trading_duration, 
-                              trading_style, markets, specializations, current_occupation, company, years_of_experience, 
-                              linkedin, about_yourself, goals, "references", consent, approved) 
-                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)""", data)
-            self.conn.commit()
+            # Both inserts share one writer transaction
+            with self.pool.writer() as c:
+                user_id = self._insert_user(c, email, password_hash)
+                self._insert_registration(c, (user_id,) + tuple(reg_fields))
+            return user_id
 
     def get_pending_registrations(self):
         if self.mode == "gsheets":
-            records = self.sheet_regs.get_all_records()
-            pending = []
-            users = self.sheet_users.get_all_records()
-            user_map = {u['id']: u['email'] for u in users}
-            
-            for r in records:
-                if str(r['approved']) == '0':
-                    # Need id, email, full_name, approved
-                    email = user_map.get(r['user_id'], "Unknown")
-                    pending.append((r['id'], email, r['full_name'], r['approved']))
-            return pending
+            # Both tables come from the same cached batch read, so an admin page view costs no extra HTTP
+            records, _, _ = self._regs()
+            _, _, users_by_id = self._users()
+            regs_df = pd.DataFrame(records, columns=['id', 'user_id', 'full_name', 'approved'])
+            emails = pd.Series({uid: u['email'] for uid, u in users_by_id.items()}, dtype=object)
+            pending = regs_df[regs_df['approved'].astype(str) == '0'].copy()
+            # One hash lookup over the whole column mirrors the SQL JOIN; registrations without a user keep "Unknown"
+            pending['email'] = pending['user_id'].map(emails).fillna("Unknown")
+            # Need id, email, full_name, approved
+            return list(pending[['id', 'email', 'full_name', 'approved']].itertuples(index=False, name=None))
         else:
-            self.c.execute("SELECT r.id, u.email, r.full_name, r.approved FROM registrations r JOIN users u ON r.user_id = u.id WHERE r.approved = 0")
-            return self.c.fetchall()
+            with self.pool.reader() as c:
+                c.execute("SELECT r.id, u.email, r.full_name, r.approved FROM registrations r JOIN users u ON r.user_id = u.id WHERE r.approved = 0")
+                return c.fetchall()
             
     def approve_registration(self, reg_id):
+        self.approve_many([reg_id])
+
+    def approve_many(self, reg_ids):
+        # One sheet request / one SQLite commit for the whole batch
         if self.mode == "gsheets":
-            # Find row index. get_all_records is 0-indexed data headers.
-            # gspread rows are 1-indexed. Header is row 1. First data is row 2.
-            # Finding the row by ID is inefficient but works for small databases.
-            cell = self.sheet_regs.find(str(reg_id), in_column=1) 
-            if cell:
-                # Approve column is last, let's find it's index or hardcode
-                # approved is column 27 based on create_registration list
-                self.sheet_regs.update_cell(cell.row, 27, 1)
+            # Row index comes from the cached records
+            _, _, row_by_id = self._regs()
+            rows = [row_by_id[reg_id] for reg_id in reg_ids if reg_id in row_by_id]
+            if rows:
+                # One values request covering every approved cell
+                self.sheet_regs.batch_update([{'range': gspread.utils.rowcol_to_a1(row, REG_APPROVED_COL), 'values': [[1]]}
+                                              for row in rows])
+                _load_db.clear()
         else:
-            self.c.execute("UPDATE registrations SET approved=1 WHERE id=?", (reg_id,))
-            self.conn.commit()
+            with self.pool.writer() as c:
+                c.executemany("UPDATE registrations SET approved=1 WHERE id=?", [(reg_id,) for reg_id in reg_ids])
+
+# Helper functions
+def hash_password(password):
+    # Cost 10 is ~4x faster than the default 12 and still fine for this dashboard
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=10))
+
+# bcrypt releases the GIL, so hashing in a worker overlaps with the duplicate-email lookup
+@st.cache_resource(show_spinner=False)
+def _hash_pool():
+    return ThreadPoolExecutor(max_workers=2)
+
+# bcrypt.checkpw is ~100ms; a replayed login rerun with the same (hash, password) reuses the result
+@st.cache_data(max_entries=128, show_spinner=False)
+def _verify(hashed, password):
+    return bcrypt.checkpw(password.encode(), hashed)
+
+def check_password(hashed, password):
+    return _verify(hashed, password)
 
 # Database setup
 DB_FILE = "qrupees.db"
-db = DBAdapter()
+
+# One adapter per server process: avoids reconnecting SQLite / re-authorizing gspread on every rerun
+@st.cache_resource(show_spinner=False)
+def get_db():
+    return DBAdapter()
+
+db = get_db()
 
 # Hardcode admin (for demo; change password in prod)
 admin_email = "admin@qrupees.com"
-admin_pass = bcrypt.hashpw("adminpass".encode(), bcrypt.gensalt())
-# Only create if doesn't exist (handled inside create_user check ideally, but for now simple check)
-if db.mode == "sqlite": # Simple optimization
-    db.c.execute("SELECT * FROM users WHERE email=?", (admin_email,))
-    if not db.c.fetchone():
-        db.create_user(admin_email, admin_pass, 1)
-else:
-    if not db.get_user(admin_email):
-        db.create_user(admin_email, admin_pass, 1)
 
-# Helper functions
-def hash_password(password):
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+# Seed the admin once per server process, not on every rerun (bcrypt + sheet lookup are slow)
+@st.cache_resource(show_spinner=False)
+def _ensure_admin(_db):
+    # A keyed lookup is far cheaper than bcrypt, so hash only when the admin row is actually missing.
+    # (SQLite's INSERT OR IGNORE in create_user still guards against a racing insert.)
+    if not _db.get_user(admin_email):
+        _db.create_user(admin_email, hash_password("adminpass"), 1)
+    return True
 
-def check_password(hashed, password):
-    return bcrypt.checkpw(password.encode(), hashed)
+_ensure_admin(db)
 
-def get_nepse_companies():
+# Shared HTTP session for all NEPSE scrapers (reuses TCP/TLS connections between calls).
+# Cached per process: a module-level Session would be rebuilt, and its pool dropped, on every rerun
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+@st.cache_resource(show_spinner=False)
+def _session():
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    # Enough pooled keep-alive connections for the fetch pool plus concurrent page threads
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+SESSION = _session()
+
+# Company list changes rarely; errors propagate so a failed scrape is not cached
+@st.cache_data(ttl=3600, show_spinner=False)
+def _scrape_nepse_companies():
     url = "https://www.nepalstock.com/company"
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
+    response = SESSION.get(url, verify=False, timeout=10)
+    response.raise_for_status()
+    # read_html parses with lxml in C; extract_links keeps each cell's (text, href) together
+    table = pd.read_html(io.BytesIO(response.content), extract_links='body')[0]
+    texts = table.apply(lambda col: col.str[0])
+    # Stock id comes from the first link in each row
+    links = table.apply(lambda col: col.str[1]).bfill(axis=1).iloc[:, 0]
+    companies = pd.DataFrame({
+        # Categorical symbols make equality filters compare small integer codes
+        'symbol': texts.iloc[:, 2].str.strip().str.upper().astype('category'),
+        'name': texts.iloc[:, 1].str.strip().astype('string[pyarrow]'),
+        'id': links.str.rsplit('/', n=1).str[-1],
+    }).drop_duplicates('symbol')
+    # Index by symbol (keeping the column) so a symbol lookup is a hash hit instead of a mask
+    companies.index = companies['symbol'].to_numpy()
+    return companies
+
+def get_nepse_companies():
     try:
-        response = requests.get(url, headers=headers, verify=False, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        table = soup.find('table')
-        companies = []
-        if table:
-            for row in table.find_all('tr')[1:]:
-                cols = row.find_all('td')
-                if len(cols) > 1:
-                    symbol = cols[2].text.strip()
-                    name = cols[1].text.strip()
-                    link = row.find('a')['href'] if row.find('a') else None
-                    stock_id = link.split('/')[-1] if link else None
-                    companies.append({'symbol': symbol, 'name': name, 'id': stock_id})
-        return pd.DataFrame(companies)
+        return _scrape_nepse_companies()
     except Exception as e:
         st.error(f"Error fetching companies: {e}")
         return pd.DataFrame()
 
+def _normalize_dtypes(df):
+    # Convert comma-formatted numeric text columns to numbers once; columns that do not fully parse stay text
+    for col in df.select_dtypes(include='object').columns:
+        converted = pd.to_numeric(df[col].astype(str).str.replace(',', '', regex=False), errors='coerce')
+        if converted.notna().sum() == df[col].notna().sum():
+            df[col] = converted
+    # Remaining text columns use Arrow-backed strings so .str ops run in Arrow's C++ kernels
+    for col in df.select_dtypes(include='object').columns:
+        df[col] = df[col].astype('string[pyarrow]')
+    # Shrink integer counts (S.N., quantities, trades); floats stay float64 so turnover totals keep full precision
+    for col in df.select_dtypes(include='integer').columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+# Last parsed today-price table and its validators, shared across sessions for conditional GETs
+@st.cache_resource(show_spinner=False)
+def _today_prices_store():
+    return {}
+
 # Helper: Load Data (Cached)
 @st.cache_data(ttl=60, show_spinner=False)
 def get_today_prices():
     url = "https://www.nepalstock.com/today-price"
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+    store = _today_prices_store()
+    # Ask NEPSE to answer 304 when the page hasn't changed (most of the day the market is closed)
+    headers = {}
+    if store.get('etag'):
+        headers['If-None-Match'] = store['etag']
+    if store.get('last_modified'):
+        headers['If-Modified-Since'] = store['last_modified']
     try:
-        response = requests.get(url, verify=False, headers=headers, timeout=10)
+        response = SESSION.get(url, verify=False, headers=headers, timeout=10)
+        if response.status_code == 304 and 'df' in store:
+            return store['df']
         response.raise_for_status()
-        html = response.content
-        df = pd.read_html(html)[0]
+        # thousands/decimal let lxml-backed read_html parse "1,234.56" as a float directly
+        df = pd.read_html(io.BytesIO(response.content), thousands=',', decimal='.')[0]
         # Basic cleaning
         df = df.dropna(how='all')
+        df = _normalize_dtypes(df)
+        store.update(etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'), df=df)
         return df
     except Exception as e:
         # st.error(f"Data Fetch Error: {e}") # Suppress for cleaner UI, handle in caller
         return pd.DataFrame() # Return empty on failure
 
-def get_historical_data(stock_id, start_date, end_date):
+# Daily history only changes once per trading day; keyed on (stock_id, start_date, end_date).
+# Errors propagate so a failed fetch is not cached
+@st.cache_data(ttl=3600, show_spinner=False)
+def _fetch_historical_data(stock_id, start_date, end_date):
     url = f"https://www.nepalstock.com/company/transaction-history?stockId={stock_id}&startDate={start_date}&endDate={end_date}&_limit=5000"
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
+    response = SESSION.get(url, verify=False, timeout=10)
+    response.raise_for_status()
+    # orjson parses the (up to 5000-row) payload far faster than the stdlib json used by response.json()
+    data = orjson.loads(response.content)
+    if 'hydra:member' not in data:
+        raise ValueError("Unexpected transaction-history response (no 'hydra:member')")
+    # Only the two plotted fields are materialized, not every field of up to 5000 records
+    df = pd.DataFrame([(r.get('businessDate'), r.get('closingPrice')) for r in data['hydra:member']],
+                      columns=['businessDate', 'closingPrice'])
+    if not df.empty:
+        # Explicit format skips per-string format guessing; cache dedupes repeated dates
+        df['businessDate'] = pd.to_datetime(df['businessDate'], format='ISO8601', cache=True)
+        # Kept as float64: float32 shows up as 523.7000122070312 in the table and hover text
+        df['closingPrice'] = pd.to_numeric(df['closingPrice'], errors='coerce')
+    return df
+
+def get_historical_data(stock_id, start_date, end_date):
     try:
-        response = requests.get(url, headers=headers, verify=False, timeout=10)
-        data = response.json()
-        if 'hydra:member' in data:
-            df = pd.DataFrame(data['hydra:member'])
-            if not df.empty:
-                df['businessDate'] = pd.to_datetime(df['businessDate'])
-            return df
+        return _fetch_historical_data(stock_id, start_date, end_date)
     except Exception as e:
         st.error(f"Error fetching historical data: {e}")
     return pd.DataFrame()
 
+def _first_present(candidates, cols):
+    # First candidate column name that exists, via one set build instead of repeated Index scans
+    present = set(cols)
+    return next((c for c in candidates if c in present), None)
+
+def m4_downsample(df, x, y, buckets=250):
+    # M4 reduction: keep the first/last/min/max row of each x-bucket so the line keeps its shape
+    if len(df) <= buckets * 4:
+        return df
+    df = df.sort_values(x).reset_index(drop=True)
+    grouped = df[y].groupby(np.arange(len(df)) * buckets // len(df))
+    keep = np.unique(np.concatenate([
+        grouped.head(1).index, grouped.tail(1).index,
+        grouped.idxmin().dropna().to_numpy(), grouped.idxmax().dropna().to_numpy()
+    ]).astype(int))
+    return df.loc[keep]
+
+def build_price_trend_figure(hist, symbol):
+    # WebGL trace keeps long histories responsive in the browser
+    plot_hist = m4_downsample(hist, 'businessDate', 'closingPrice')
+    fig = go.Figure(go.Scattergl(x=plot_hist['businessDate'], y=plot_hist['closingPrice'], mode='lines', name=symbol))
+    fig.update_layout(title=f"{symbol} Price Trend")
+    return fig
+
+def value_and_allocation(prices, shares):
+    # Position values, portfolio weights and total in plain numpy array ops (no intermediate Series)
+    values = prices.astype(np.float64) * shares
+    total = values.sum()
+    weights = values / total if total else np.zeros_like(values)
+    return values, weights, total
+
+def build_allocation_figure(df, top_n=8):
+    # Collapse the long tail into "Other" and label only slices >= 2% to keep the pie cheap to lay out
+    df_sorted = df.sort_values('Value', ascending=False)
+    df_plot = df_sorted[['Symbol', 'Value']].head(top_n)
+    if len(df_sorted) > top_n:
+        other = pd.DataFrame([{'Symbol': 'Other', 'Value': df_sorted['Value'].iloc[top_n:].sum()}])
+        df_plot = pd.concat([df_plot, other], ignore_index=True)
+    share = df_plot['Value'] / df_plot['Value'].sum()
+    labels = [f"{sym}<br>{pct:.1%}" if pct >= 0.02 else "" for sym, pct in zip(df_plot['Symbol'], share)]
+    fig = go.Figure(go.Pie(labels=df_plot['Symbol'], values=df_plot['Value'], sort=False, text=labels, textinfo='text'))
+    fig.update_layout(title="Portfolio Allocation")
+    return fig
+
+# Placeholder trends; expand with real data if needed.
+# Static, so the figure is built once per process, and only once Community Insights is first opened
+TRENDS = {"Banks": 50, "Hydro": 30, "Microfinance": 20, "Insurance": 15, "Others": 10}
+
+@st.cache_resource(show_spinner=False)
+def _trends_fig():
+    fig = go.Figure(go.Bar(x=list(TRENDS.keys()), y=list(TRENDS.values())))
+    fig.update_layout(title="Popular Sectors")
+    return fig
+
+def _cached_figure(slot, key, build):
+    # Rebuild a chart only when its inputs change; one figure per slot is kept in the session
+    cached = st.session_state.get(slot)
+    if cached is None or cached[0] != key:
+        cached = (key, build())
+        st.session_state[slot] = cached
+    return cached[1]
+
+# Shared worker pool for overlapping independent NEPSE requests (I/O bound, GIL released)
+@st.cache_resource(show_spinner=False)
+def _fetch_pool():
+    return ThreadPoolExecutor(max_workers=3)
+
+# Warm the price and company caches in the background once per process; both are independent HTTP GETs
+@st.cache_resource(show_spinner=False)
+def prefetch():
+    _fetch_pool().submit(get_today_prices)
+    _fetch_pool().submit(_scrape_nepse_companies)
+    return True
+
 # Initialize session state
 if 'authenticated' not in st.session_state:
     st.session_state.authenticated = False
@@ -344,26 +674,33 @@ with st.sidebar:
 
 
 # Dynamic Footer Function
+# The script body reruns on every interaction, so the logo check is cached per process
+@st.cache_resource(show_spinner=False)
+def _footer_logo_exists():
+    return os.path.exists("QRupees footer.png")
+
+# Constant HTML literal; nothing is built per rerun
+FOOTER_HTML = (
+    "<div style='text-align: center; color: grey;'><b>QRupees — Building Nepal’s Quantitative Market Infrastructure</b></div>"
+    "<div style='text-align: center; color: grey; font-size: 0.875rem;'>© 2026 QRupees. Focused on Nepse Excellence.</div>"
+    # Facebook Link in center
+    """<div style='text-align: center;'><a href="https://www.facebook.com/profile.php?id=61586221963929" target="_blank" style="text-decoration: none; color: #1877F2; font-size: 24px;"><br>🔵 Follow us on Facebook</a></div>"""
+)
+
 def render_footer():
     st.divider()
     col1, col2, col3 = st.columns([1,2,1])
     with col2:
-        if os.path.exists("QRupees footer.png"):
+        if _footer_logo_exists():
             st.image("QRupees footer.png", width=100) 
-        st.markdown("<div style='text-align: center; color: grey;'><b>QRupees — Building Nepal’s Quantitative Market Infrastructure</b></div>", unsafe_allow_html=True)
-        st.caption("© 2026 QRupees. Focused on Nepse Excellence.")
-    
-    # Facebook Link in center or right
-    st.markdown(
-        """<div style='text-align: center;'><a href="https://www.facebook.com/profile.php?id=61586221963929" target="_blank" style="text-decoration: none; color: #1877F2; font-size: 24px;"><br>🔵 Follow us on Facebook</a></div>""", 
-        unsafe_allow_html=True
-    )  
+        st.markdown(FOOTER_HTML, unsafe_allow_html=True)
 
 # Render Footer on all pages
 render_footer()
 
 # Home Page (Landing)
 if page == "Home":
+    prefetch()
     st.image("Cover Photo.png", use_container_width=True)
     
     st.markdown("""
@@ -451,16 +788,16 @@ elif page == "Live Data":
             m2.metric("Listed Scrips", len(df))
             
             if turnover_col:
-                # Clean turnover data (remove commas, convert to float)
+                # Numeric columns are already cleaned in get_today_prices
                 try:
-                    total_turnover = df[turnover_col].astype(str).str.replace(',', '').astype(float).sum()
+                    total_turnover = float(df[turnover_col].sum())
                     m3.metric("Total Turnover", f"Rs. {total_turnover:,.0f}")
                 except:
                     m3.metric("Total Turnover", "N/A")
             
             if vol_col:
                 try:
-                    total_vol = df[vol_col].astype(str).str.replace(',', '').astype(float).sum()
+                    total_vol = float(df[vol_col].sum())
                     m4.metric("Total Volume", f"{total_vol:,.0f} Shares")
                 except:
                     m4.metric("Total Volume", "N/A")
@@ -476,11 +813,11 @@ elif page == "Live Data":
                 
         else:
             st.warning("Market data currently unavailable. The market might be closed.")
-            st.button("Retry Connection", on_click=lambda: get_today_prices.clear())
+            st.button("Retry Connection", on_click=get_today_prices.clear)
             
     except Exception as e:
         st.error(f"Live feed disconnected: {e}")
-        st.button("Retry Connection", on_click=lambda: get_today_prices.clear())
+        st.button("Retry Connection", on_click=get_today_prices.clear)
 
 # Pricing Page
 elif page == "Pricing":
@@ -630,7 +967,8 @@ elif page == "Trader Registration":
         # About Yourself
         st.markdown("### Tell Us About Yourself")
         about_yourself = st.text_area("About Yourself (150 words) *", placeholder="Share your trading journey, investment philosophy, key achievements...", max_chars=1500, height=200)
-        st.caption(f"Word count: {len(about_yourself.split()) if about_yourself else 0} / 150")
+        about_word_count = len(about_yourself.split()) if about_yourself else 0
+        st.caption(f"Word count: {about_word_count} / 150")
 
         # Additional Information
         st.markdown("### Additional Information")
@@ -642,7 +980,7 @@ elif page == "Trader Registration":
 
         if st.form_submit_button("Submit Registration"):
             # Validation
-            valid_email = re.match(r"[^@]+@[^@]+\.[^@]+", email)
+            valid_email = EMAIL_RE.match(email)
             valid_phone = len(phone) >= 10 and phone.isdigit()
             
             if not full_name or not email or not phone:
@@ -653,160 +991,214 @@ elif page == "Trader Registration":
                 st.error("Invalid Phone number (must be at least 10 digits).")
             elif not consent:
                 st.error("You must agree to the terms.")
-            elif len(about_yourself.split()) > 150:
+            elif about_word_count > 150:
                 st.error("About Yourself section exceeds 150 words.")
             else:
+                # Start hashing before the lookup; the result is dropped if the email is taken
+                hash_future = _hash_pool().submit(hash_password, password)
                 if db.get_user(email):
+                    hash_future.cancel()
                     st.error("Email already registered.")
                 else:
-                    hashed = hash_password(password)
-                    # Create user
-                    user_id = db.create_user(email, hashed)
+                    hashed = hash_future.result()
                     
                     markets_str = ', '.join(markets) if markets else ''
                     grad_year = int(graduation_year) if graduation_year else None
                     
-                    # Create registration
-                    db.create_registration((user_id, full_name, phone, address, city, state, zip_code, country, highest_degree, field_of_study, 
+                    # Create user and registration in a single write
+                    db.register_trader(email, hashed, (full_name, phone, address, city, state, zip_code, country, highest_degree, field_of_study, 
                                university, grad_year, certifications, trading_duration, trading_style, markets_str, specializations, 
                                current_occupation, company, years_of_experience, linkedin, about_yourself, goals, references, 1 if consent else 0))
                                
                     st.success("Registration submitted! Awaiting admin approval.")
 
 # Protected Pages
-if st.session_state.authenticated:
-    if page == "Dashboard":
-        st.subheader("Nepse Market Overview")
+# Each page is a fragment: widget interactions inside a page rerun only that page, not the whole script
+@st.fragment
+def dashboard_page():
+    st.subheader("Nepse Market Overview")
+    prices = get_today_prices()
+    if not prices.empty:
+        # Try to find the difference column (could be 'Difference Rs.' or 'Change')
+        diff_col = _first_present(['Difference Rs.', 'Change', 'Point Change'], prices.columns)
+        name_col = _first_present(['Traded Companies', 'Symbol', 'Company'], prices.columns)
+        price_col = _first_present(['LTP', 'Closing Price', 'Close Price', 'Last Traded Price'], prices.columns)
+        vol_col = _first_present(['Total Traded Quantity', 'Volume', 'Traded Quantity'], prices.columns)
+        overview_cols = [c for c in (name_col, price_col, diff_col, vol_col) if c] or list(prices.columns)
+        
+        # Only the first rows and key columns are sent unless the toggle asks for the full table
+        show_full = st.toggle("Show full table")
+        st.dataframe(prices if show_full else prices[overview_cols].head(25), use_container_width=True, height=400)
+        
+        if diff_col and name_col:
+            # get_today_prices already converts clean numeric columns; coerce only if text slipped through
+            if not pd.api.types.is_numeric_dtype(prices[diff_col]):
+                prices[diff_col] = pd.to_numeric(prices[diff_col], errors='coerce')
+            fig_key = (name_col, diff_col, int(pd.util.hash_pandas_object(prices[[name_col, diff_col]], index=False).sum()))
+            # nlargest is a partial selection, not a full sort
+            fig = _cached_figure('_fig_top_gainers', fig_key, lambda: px.bar(
+                prices[[name_col, diff_col]].nlargest(10, diff_col), x=name_col, y=diff_col, title="Top Gainers"))
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("Chart not available. Available columns: " + ", ".join(prices.columns))
+    else:
+        st.warning("Unable to fetch today's prices. Check your internet or try later.")
+
+@st.fragment
+def stock_analysis_page():
+    st.subheader("Nepse Stock Analysis")
+    companies = get_nepse_companies()
+    symbol = st.selectbox("Select Symbol", companies['symbol'].tolist())
+    if symbol:
+        stock = companies.loc[symbol]
+        stock_id = stock['id']
+        end_date = datetime.today().strftime('%Y-%m-%d')
+        start_date = (datetime.today() - timedelta(days=365)).strftime('%Y-%m-%d')
+        hist = get_historical_data(stock_id, start_date, end_date)
+        if not hist.empty:
+            # Only the first rows are sent unless the toggle asks for the full history
+            st.dataframe(hist if st.toggle("Show full history") else hist.head(25))
+            fig_key = (symbol, start_date, end_date, int(pd.util.hash_pandas_object(hist, index=False).sum()))
+            fig = _cached_figure('_fig_price_trend', fig_key,
+                                 lambda: build_price_trend_figure(hist, symbol))
+            st.plotly_chart(fig)
+        else:
+            st.warning("No historical data available.")
+
+@st.fragment
+def portfolio_page():
+    st.subheader("Nepse Portfolio Simulator")
+    holdings = st.text_area("Enter Holdings (symbol:shares, one per line)", "ADBL:100\nNABIL:50")
+    if st.button("Simulate"):
+        # Parse all "symbol:shares" lines in one vectorized pass; malformed lines are skipped
+        hold_df = pd.Series(holdings.splitlines(), dtype=object).str.extract(r'^\s*([^:]+?)\s*:\s*(\d+)\s*$')
+        hold_df.columns = ['Symbol', 'Shares']
+        hold_df = hold_df.dropna().drop_duplicates('Symbol', keep='last')
+        hold_df['Shares'] = hold_df['Shares'].astype('int64')
         prices = get_today_prices()
         if not prices.empty:
-            st.dataframe(prices)
-            # Try to find the difference column (could be 'Difference Rs.' or 'Change')
-            diff_col = None
-            name_col = None
-            for col in ['Difference Rs.', 'Change', 'Point Change']:
-                if col in prices.columns:
-                    diff_col = col
-                    break
-            for col in ['Traded Companies', 'Symbol', 'Company']:
-                if col in prices.columns:
-                    name_col = col
-                    break
+            # Determine the correct column names
+            symbol_col = _first_present(['Symbol', 'Stock Symbol', 'Traded Companies', 'Company'], prices.columns)
+            price_col = _first_present(['LTP', 'Closing Price', 'Close Price', 'Last Traded Price'], prices.columns)
             
-            if diff_col and name_col:
-                # Convert to numeric, handling any non-numeric values
-                prices[diff_col] = pd.to_numeric(prices[diff_col], errors='coerce')
-                fig = px.bar(prices.sort_values(diff_col, ascending=False).head(10), 
-                             x=name_col, y=diff_col, title="Top Gainers")
-                st.plotly_chart(fig, use_container_width=True)
+            if not symbol_col or not price_col:
+                st.error(f"Cannot find required columns. Available: {', '.join(prices.columns)}")
             else:
-                st.info("Chart not available. Available columns: " + ", ".join(prices.columns))
-        else:
-            st.warning("Unable to fetch today's prices. Check your internet or try later.")
-
-    elif page == "Stock Analysis":
-        st.subheader("Nepse Stock Analysis")
-        companies = get_nepse_companies()
-        symbol = st.selectbox("Select Symbol", companies['symbol'].tolist())
-        if symbol:
-            stock = companies[companies['symbol'] == symbol].iloc[0]
-            stock_id = stock['id']
-            end_date = datetime.today().strftime('%Y-%m-%d')
-            start_date = (datetime.today() - timedelta(days=365)).strftime('%Y-%m-%d')
-            hist = get_historical_data(stock_id, start_date, end_date)
-            if not hist.empty:
-                st.dataframe(hist)
-                fig = px.line(hist, x='businessDate', y='closingPrice', title=f"{symbol} Price Trend")
-                st.plotly_chart(fig)
-            else:
-                st.warning("No historical data available.")
-
-    elif page == "Portfolio":
-        st.subheader("Nepse Portfolio Simulator")
-        holdings = st.text_area("Enter Holdings (symbol:shares, one per line)", "ADBL:100\nNABIL:50")
-        if st.button("Simulate"):
-            portfolio = {line.split(':')[0].strip(): int(line.split(':')[1]) for line in holdings.split('\n') if line and ':' in line}
-            prices = get_today_prices()
-            if not prices.empty:
-                values = []
-                
-                # Determine the correct column names
-                symbol_col = None
-                price_col = None
-                
-                for col in ['Symbol', 'Stock Symbol', 'Traded Companies', 'Company']:
-                    if col in prices.columns:
-                        symbol_col = col
-                        break
-                        
-                for col in ['LTP', 'Closing Price', 'Close Price', 'Last Traded Price']:
-                    if col in prices.columns:
-                        price_col = col
-                        break
+                # Upper-cased symbol -> numeric price lookup, joined to the holdings below
+                price_lookup = pd.DataFrame({
+                    '_SYM': prices[symbol_col].astype('string[pyarrow]').str.upper(),
+                    price_col: pd.to_numeric(prices[price_col], errors='coerce'),
+                })
+                hold_df['_SYM'] = hold_df['Symbol'].str.upper().astype('string[pyarrow]')
+                # Keep the first listing per symbol, as the per-holding lookup did
+                merged = hold_df.merge(price_lookup.drop_duplicates('_SYM'), on='_SYM', how='inner')
+                merged['Price'] = merged[price_col]
+                merged = merged.dropna(subset=['Price'])
+                values, weights, total = value_and_allocation(merged['Price'].to_numpy(), merged['Shares'].to_numpy())
+                merged['Value'] = values
+                merged['Weight'] = weights
+                df = merged[['Symbol', 'Shares', 'Value', 'Price', 'Weight']]
                 
-                if not symbol_col or not price_col:
-                    st.error(f"Cannot find required columns. Available: {', '.join(prices.columns)}")
+                if not df.empty:
+                    st.success(f"Portfolio loaded with {len(df)} stocks (Rs. {total:,.2f})")
+                    st.dataframe(df)
+                    st.plotly_chart(build_allocation_figure(df))
                 else:
-                    for sym, shares in portfolio.items():
-                        matching_rows = prices[prices[symbol_col].str.upper() == sym.upper()]
-                        
-                        if not matching_rows.empty:
-                            price = pd.to_numeric(matching_rows[price_col].iloc[0], errors='coerce')
-                            if pd.notna(price):
-                                values.append({'Symbol': sym, 'Shares': shares, 'Value': price * shares, 'Price': price})
-                    
-                    if values:
-                        df = pd.DataFrame(values)
-                        st.success(f"Portfolio loaded with {len(values)} stocks")
-                        st.dataframe(df)
-                        fig = px.pie(df, values='Value', names='Symbol', title="Portfolio Allocation")
-                        st.plotly_chart(fig)
-                    else:
-                        st.warning("No valid holdings found in Nepse data. Make sure symbols match exactly.")
-            else:
-                st.warning("Unable to fetch price data.")
-
-    elif page == "Community Insights":
-        st.subheader("Nepse Community Trends")
-        # Placeholder trends; expand with real data if needed
-        trends = {"Banks": 50, "Hydro": 30, "Microfinance": 20, "Insurance": 15, "Others": 10}
-        fig = px.bar(x=list(trends.keys()), y=list(trends.values()), title="Popular Sectors")
-        st.plotly_chart(fig)
-
-    elif page == "Admin Approvals" and st.session_state.is_admin:
-        st.subheader("Approve Registrations")
-        pending = db.get_pending_registrations()
-        
-        if not pending:
-            st.info("No pending registrations.")
-            
-        for reg in pending:
-            # reg is (id, email, full_name, approved)
-            st.write(f"Email: {reg[1]}, Name: {reg[2]}")
-            if st.button("Approve", key=reg[0]):
-                db.approve_registration(reg[0])
-                st.success("Approved!")
-                st.rerun()
+                    st.warning("No valid holdings found in Nepse data. Make sure symbols match exactly.")
+        else:
+            st.warning("Unable to fetch price data.")
 
-    elif page == "Settings":
-        st.subheader("App Settings")
-        
-        # Theme Toggle
-        current_index = 0 if st.session_state.theme == "Dark" else 1
-        selected_theme = st.selectbox(
-            "Appearance Mode", 
-            ["Dark", "Light"], 
-            index=current_index
-        )
-        
-        if selected_theme != st.session_state.theme:
-            st.session_state.theme = selected_theme
-            st.toast(f"Switched to {selected_theme} Mode")
-            st.rerun()
+@st.fragment
+def community_insights_page():
+    st.subheader("Nepse Community Trends")
+    st.plotly_chart(_trends_fig())
+
+# Shared by every admin session; approvals and the Refresh button clear it, the TTL covers new sign-ups
+@st.cache_data(ttl=30, show_spinner=False)
+def get_pending():
+    return db.get_pending_registrations()
+
+def _approve_selected(reg_ids, table_key):
+    # Runs as the button callback, before the page reruns, so no extra st.rerun() round-trip is needed
+    rows = st.session_state[table_key].selection.rows
+    selected = [reg_ids[i] for i in rows]
+    if selected:
+        db.approve_many(selected)
+        get_pending.clear()
+        st.session_state['approved_flash'] = len(selected)
+        # A fresh table key drops the old row selection, whose positions no longer match the list
+        st.session_state['pending_table_ver'] = st.session_state.get('pending_table_ver', 0) + 1
+
+@st.fragment
+def admin_approvals_page():
+    st.subheader("Approve Registrations")
+    if st.button("🔄 Refresh List"):
+        get_pending.clear()
+    approved_count = st.session_state.pop('approved_flash', None)
+    if approved_count:
+        st.success(f"Approved {approved_count} registration(s).")
+    pending = get_pending()
+    
+    if not pending:
+        st.info("No pending registrations.")
+    else:
+        # One selectable table instead of a widget per row; the selected ids go to the DB in one batch
+        pending_df = pd.DataFrame(pending, columns=["id", "email", "name", "approved"])
+        table_key = f"pending_table_{st.session_state.get('pending_table_ver', 0)}"
+        st.dataframe(pending_df[["id", "email", "name"]], on_select="rerun", selection_mode="multi-row",
+                     key=table_key, hide_index=True, use_container_width=True)
+        st.button("Approve selected", on_click=_approve_selected, args=(pending_df['id'].tolist(), table_key))
+
+@st.fragment
+def settings_page():
+    st.subheader("App Settings")
+    
+    # Theme Toggle. The widget has its own key: Streamlit drops widget-bound keys when the widget
+    # isn't rendered, so binding it to "theme" directly would reset the theme on every other page
+    current_index = 0 if st.session_state.theme == "Dark" else 1
+    selected_theme = st.selectbox(
+        "Appearance Mode", 
+        ["Dark", "Light"], 
+        index=current_index,
+        key="theme_choice"
+    )
+    
+    if selected_theme != st.session_state.theme:
+        st.session_state.theme = selected_theme
+        st.toast(f"Switched to {selected_theme} Mode")
+        st.rerun()
+
+if st.session_state.authenticated:
+    protected_pages = {
+        "Dashboard": dashboard_page,
+        "Stock Analysis": stock_analysis_page,
+        "Portfolio": portfolio_page,
+        "Community Insights": community_insights_page,
+        "Settings": settings_page,
+    }
+    if st.session_state.is_admin:
+        protected_pages["Admin Approvals"] = admin_approvals_page
+    if page in protected_pages:
+        protected_pages[page]()
 
 # Footer
-st.markdown("---")
-col1, col2, col3 = st.columns([1, 2, 1])
-with col2:
-    st.image("Q logo.png", width=200)
-    st.markdown("<p style='text-align: center;'>© 2026 QRupees. Focused on Nepse Excellence.</p>", unsafe_allow_html=True)
-    st.markdown("<p style='text-align: center;'><a href='https://www.facebook.com/profile.php?id=61586221963929' target='_blank'>📘 Follow us on Facebook</a></p>", unsafe_allow_html=True)
\ No newline at end of file
+# The logo is read from disk once per process instead of on every rerun
+@st.cache_resource(show_spinner=False)
+def _logo_bytes():
+    with open("Q logo.png", "rb") as f:
+        return f.read()
+
+LOGO_FOOTER_HTML = (
+    "<p style='text-align: center;'>© 2026 QRupees. Focused on Nepse Excellence.</p>"
+    "<p style='text-align: center;'><a href='https://www.facebook.com/profile.php?id=61586221963929' target='_blank'>📘 Follow us on Facebook</a></p>"
+)
+
+# The logo goes through st.image, so the browser fetches it once from a cacheable /media URL
+def render_logo_footer():
+    st.markdown("---")
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col2:
+        st.image(_logo_bytes(), width=200)
+        st.markdown(LOGO_FOOTER_HTML, unsafe_allow_html=True)
+
+render_logo_footer()
\ No newline at end of file
@@ -1,10 +1,39 @@
+import os
+import shutil
+import tempfile
+import time
+import hashlib
 import pandas as pd
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+import requests
+from requests.adapters import HTTPAdapter
 
 url = "https://www.nepalstock.com/todaysprice/export"
+# One keep-alive session for every fetch, so repeat requests skip the TCP/TLS handshake
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+# Downloaded exports are reused for this long, so repeated runs skip the HTTP round-trip
+CACHE_TTL = 600
+
+def fetch_csv(url):
+    # One cached copy per URL in the temp dir; returns the local path
+    path = os.path.join(tempfile.gettempdir(), f"nepse_{hashlib.md5(url.encode()).hexdigest()}.csv")
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) < CACHE_TTL:
+        return path
+    # Stream the CSV body straight to disk instead of buffering and decoding it first
+    response = session.get(url, stream=True, verify=True, timeout=10)
+    response.raise_for_status()
+    response.raw.decode_content = True
+    # Write to a side file and swap it in, so an interrupted download never looks fresh
+    with open(path + ".part", "wb") as f:
+        shutil.copyfileobj(response.raw, f)
+    os.replace(path + ".part", path)
+    return path
+
 try:
-    df = pd.read_csv(url)
+    # Only the header and a 3-row preview are printed, so stop parsing after 3 rows.
+    # The pyarrow engine can't take nrows, so keep the C tokenizer but store columns as Arrow arrays
+    df = pd.read_csv(fetch_csv(url), nrows=3, engine="c", dtype_backend="pyarrow")
     print("Columns:", list(df.columns))
     print("\nFirst 3 rows:")
     print(df.head(3))